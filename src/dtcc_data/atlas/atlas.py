@@ -1,8 +1,7 @@
 import time
-import requests
 import webbrowser
 
-from .checker import get_missing_files
+from .checker import get_missing_files, session
 
 from dtcc_data.logging import debug,info,warning,error
 
@@ -28,10 +27,20 @@ def get_bounding_box():
         info("Map opened successfully. Please draw a rectangle and submit.")
 
         # Step 2: Wait for the user to submit the coordinates
+        # The server holds each request until the coordinates are submitted
+        # or the timeout passes, so they are received as soon as possible.
+        # Servers without /wait_coordinates are polled every 5 seconds
         coordinates = None
+        long_poll = True
         while coordinates is None:
-            time.sleep(5)  # Wait for 5 seconds before checking again
-            response = requests.get(f'{DOMAIN_NAME}/get_coordinates')
+            if long_poll:
+                response = session().get(f'{DOMAIN_NAME}/wait_coordinates', params={'timeout': 10}, timeout=30)
+                if response.status_code == 404:
+                    long_poll = False
+                    continue
+            else:
+                time.sleep(5)  # Wait for 5 seconds before checking again
+                response = session().get(f'{DOMAIN_NAME}/get_coordinates')
             
             if response.status_code == 200:
                 coordinates = response.json().get('coordinates')
@@ -39,6 +48,8 @@ def get_bounding_box():
                 warning(response.json().get('error'))
             else:
                 warning(f"Unexpected status code: {response.status_code}")
+                if long_poll:
+                    time.sleep(5)
         
         # Step 3: Print the received coordinates
         info("Coordinates received")
@@ -1,22 +1,35 @@
 import sys
-import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import subprocess
-import json
+import orjson
 import os
 import tarfile
 import paramiko
 from tqdm import tqdm
+from tqdm.utils import CallbackIOWrapper
 import getpass
 import keyring
 from keyrings.alt.file import PlaintextKeyring
 
-from .prototype import find_files
-from .utils import update_gpkg_atlas, update_laz_atlas
+from .prototype import TileIndex, find_files
+from .utils import read_atlas, update_gpkg_atlas, update_laz_atlas
 
 from dtcc_data.logging import info,warning,error,critical,file_diff_info
 from dtcc_core.model import Bounds
 
+# Local atlases indexed by filename, reused while the file is unchanged
+_ATLAS_CACHE = {}
+
+# Shared session so consecutive requests to the data server reuse the same
+# keep-alive connection instead of opening a new one each time
+_SESSION = requests.Session()
+_SESSION.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+def session():
+    """Returns the shared requests session used to talk to the data server"""
+    return _SESSION
     
 def check_data_directory(parameters):
     try:
@@ -87,6 +100,23 @@ def set_ssh(parameters):
             ssh.close()
     return flag
 
+def load_local_atlas(filename):
+    """Reads a local atlas as a TileIndex, parsing the file again only after it was modified
+
+    Args:
+        filename (string): atlas filename
+
+    Returns:
+        TileIndex: the tiles of the atlas
+    """
+    mtime = os.stat(filename).st_mtime_ns
+    cached = _ATLAS_CACHE.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    index = TileIndex(read_atlas(filename))
+    _ATLAS_CACHE[filename] = (mtime, index)
+    return index
+
 def files_to_send(local, server):
     """
     Compares lists of strings that are the filenames of the client and the server to check which files are missing
@@ -97,13 +127,10 @@ def files_to_send(local, server):
     Returns:
         list[string] : filenames that are missing from the client
     """
-    local = np.array(local)
-    server = np.array(server)
-    dif1 = np.setdiff1d(local, server)
-    dif2 = np.setdiff1d(server, local)
-    
-    temp3 = np.concatenate((dif1, dif2))
-    return temp3
+    # Only files the server has and the client lacks need to be downloaded;
+    # files that exist only locally cannot be requested from the server
+    missing = set(server).difference(local)
+    return sorted(missing)
 
 def get_files_from_server(bounding_box: Bounds, url, type):
     """sends request to the server with the initial bounding box and expects a list of filenames 
@@ -119,7 +146,7 @@ def get_files_from_server(bounding_box: Bounds, url, type):
     """
     payload = {"points" : bounding_box.tuple, "type": type}
     url = url + '/api/post/boundingbox'
-    response = requests.post(url, json=payload)
+    response = _SESSION.post(url, json=payload)
 
     # Check the status code to see if the request was successful
     if response.status_code == 200:
@@ -132,12 +159,15 @@ def get_files_from_server(bounding_box: Bounds, url, type):
         
     
 def download_missing_files(missing_files, url, type, parameters):
-    """Sends request to the server with the filenames of the missing files and downloads them as a tar
+    """Sends request to the server with the filenames of the missing files and extracts the tar it returns
 
     Args:
         missing_files (list[string]): The list of the missing files
         url (string): Server's url
         type (string): bygg, laz or vl
+
+    Returns:
+        list[string]: names of the extracted files, None if nothing was downloaded
     """
     if not check_data_directory(parameters):
         return
@@ -149,20 +179,23 @@ def download_missing_files(missing_files, url, type, parameters):
         url = url + '/download-bygg'
     elif type == "vl":
         url = url + "/download-vl"
-    # Local filename to save the downloaded file
-    local_filename = 'sample.tar'
-    payload = {"filenames":missing_files.tolist()}
-    with requests.get(url, stream=True, json=payload) as r:
+    data_dir = os.path.join(parameters["cache_directory"], "dtcc-atlas-data", f"{type}_data")
+    os.makedirs(data_dir, exist_ok=True)
+    extract_options = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    payload = {"filenames":missing_files}
+    with _SESSION.get(url, stream=True, json=payload) as r:
         r.raise_for_status()
         total_size_in_bytes = int(r.headers.get('content-length', 0))
 
-        # Initialize the progress bar
-        with tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True, desc=local_filename) as progress:
-            with open(local_filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    progress.update(len(chunk))
-                    f.write(chunk)
-        info(f"File downloaded successfully: " + str(local_filename))
+        # Extract the archive while it is downloaded instead of saving it to
+        # disk first, the progress bar follows the bytes read from the socket
+        r.raw.decode_content = True
+        with tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True, desc=type) as progress:
+            with tarfile.open(fileobj=CallbackIOWrapper(progress.update, r.raw, "read"), mode="r|*", bufsize=1 << 20) as new_files:
+                new_files.extractall(data_dir, **extract_options)
+                filenames = new_files.getnames()
+        info(f"Files downloaded successfully: " + str(len(filenames)))
+    return filenames
 
 def get_missing_files(bounding_box: Bounds, url, type, parameters):
     """Preprocess the data and calls previous functions
@@ -176,6 +209,9 @@ def get_missing_files(bounding_box: Bounds, url, type, parameters):
     except:
         info("The server seems to be down, try again later")
         return
+    if not server_files:
+        # Nothing on the server can be missing locally
+        return
     if type == "laz":
         filename = "tester_laz.json"
     elif type == "bygg":
@@ -183,9 +219,8 @@ def get_missing_files(bounding_box: Bounds, url, type, parameters):
     elif type == "vl":
         filename = "tester_vl.json"
     try:
-        with open(filename, 'r') as file:
-            data = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
+        data = load_local_atlas(filename)
+    except (FileNotFoundError, orjson.JSONDecodeError):
         warning("Local atlas was not found")
         data = {}
     local_files = find_files(data, bounding_box)
@@ -193,70 +228,39 @@ def get_missing_files(bounding_box: Bounds, url, type, parameters):
     file_diff_info(local_files, server_files,True)
     missing_files = files_to_send(local_files, server_files)
     
-    if missing_files.size != 0:
+    if missing_files:
         info("There are missing files locally, do you want to download them? Downloading extra files requires authentication.")
         info("Answer with y,n")
         flag = True
         while flag:
             answer = input()
             if answer == "y":
-                download_missing_files(missing_files, url, type, parameters)
+                filenames = download_missing_files(missing_files, url, type, parameters)
                 flag = False
             elif answer == "n":
                 return
             else:
                 print("Please enter y or n only.")
         
-        fix_atlas(type, parameters)
+        if filenames is not None:
+            fix_atlas(type, parameters, filenames)
     
-def fix_atlas(type, parameters):
-    """Handles the extraction of the downloaded data and calls respective functions to update client side atlas
+def fix_atlas(type, parameters, filenames):
+    """Calls respective functions to update client side atlas with the downloaded data
 
     Args:
         type (string): gpkg or laz
+        filenames (list[string]): names of the downloaded files
     """
     
     user_data_dir = parameters["cache_directory"]
     data_path = os.path.join(user_data_dir, "dtcc-atlas-data")
-    with tarfile.open("sample.tar", "r") as new_files:
-        new_files.extractall("new_files")
+    data_dir = os.path.join(data_path, f"{type}_data")
     if type == "laz":
-        update_laz_atlas("new_files", "tester_laz.json")
-        laz_data = os.path.join(data_path, "laz_data")
-        try:
-            os.makedirs(laz_data)
-        except:
-            pass
-        for file in os.listdir("new_files"):
-            os.rename(f"new_files/{file}", f"{laz_data}/{file}")
-    elif type == "bygg":
-        update_gpkg_atlas("new_files", "tester_bygg.json")
-        bygg_data = os.path.join(data_path, "bygg_data")
-        try:
-            os.makedirs(bygg_data)
-        except:
-            pass
-        for file in os.listdir("new_files"):
-            if file.endswith("json"):
-                file = os.path.join("new_files", file)
-                os.remove(file)
-                continue
-            os.rename(f"new_files/{file}", f"{bygg_data}/{file}")
-    elif type == "vl":
-        update_gpkg_atlas("new_files", "tester_vl.json")
-        vl_data = os.path.join(data_path, "vl_data")
-        try:
-            os.makedirs(vl_data)
-        except:
-            pass
-        for file in os.listdir("new_files"):
-            if file.endswith("json"):
-                file = os.path.join("new_files", file)
-                os.remove(file)
-                continue
-            os.rename(f"new_files/{file}", f"{vl_data}/{file}")
-    os.remove("sample.tar")
-    os.removedirs("new_files")
+        update_laz_atlas(data_dir, "tester_laz.json", filenames)
+    elif type == "bygg" or type == "vl":
+        update_gpkg_atlas(data_dir, f"tester_{type}.json")
+        os.remove(os.path.join(data_dir, "missing_coords.json"))
     info("The data are saved in: "+ str(data_path))
     
 # if __name__ == "__main__":
@@ -1,103 +1,109 @@
-import json
-import time
+import threading
+
+import shapely
+import numpy as np
 from shapely.geometry import box, Polygon
-import geopandas as gpd
 
-from dtcc_data.logging import debug,info,warning,error
+from dtcc_data.logging import info
 
-def binary_search_within_range(arr, low_bound, high_bound):
-    """search of a coordinate within range 
+# Area covered by the data server, built and prepared once since it is tested
+# against every requested area
+HARDCODED_BOUNDS = Polygon([(266646,5921055), (516646,5921055),(766646,6171055),(1016646,6921055), (516646,5421055), (516646,7671055), (266646,7421055), (266646,5921055)])
+shapely.prepare(HARDCODED_BOUNDS)
 
-    Args:
-        arr (list[int]):list that contains a coordinate(x or y) to be searched
-        low_bound (int): The low bound to search within
-        high_bound (int): The high bound to search within
+# Number of query results kept by each TileIndex
+QUERY_CACHE_SIZE = 256
 
-    Returns:
-        int:index of first element that is found withing bounds  
+class TileIndex:
+    """Structure-of-arrays view of an atlas, built once when the atlas is loaded
+
+    Args:
+        data (directory): The atlas directory, {minx: {miny: {"width", "height", "filename"}}}
     """
-    low, high = 0, len(arr) - 1
-    
-    while low <= high:
-        mid = (low + high) // 2
-        current_value = int(arr[mid])  # Convert the current string to integer
-
-        if low_bound <= current_value <= high_bound:
-            # Check if it's the first element in the range or the element before is not in the range
-            if mid == 0 or int(arr[mid - 1]) < low_bound:
-                return mid  # Return the index of the element
-            else:
-                high = mid - 1  # Continue to search in the left half
-        elif current_value < low_bound:
-            low = mid + 1  # Search in the right half
-        else:
-            high = mid - 1  # Search in the left half
-    
-    return None  # Index not found if no element within the range
 
+    def __init__(self, data):
+        xs, ys, widths, heights, filenames = [], [], [], [], []
+        for x_min, column in data.items():
+            for y_min, tile in column.items():
+                xs.append(float(x_min))
+                ys.append(float(y_min))
+                widths.append(tile["width"])
+                heights.append(tile["height"])
+                filenames.append(tile["filename"])
+
+        # Keep the tiles sorted by their lower left corner
+        order = np.lexsort((ys, xs))
+        self.xs = np.asarray(xs, dtype=np.float64)[order]
+        self.ys = np.asarray(ys, dtype=np.float64)[order]
+        self.widths = np.asarray(widths, dtype=np.float64)[order]
+        self.heights = np.asarray(heights, dtype=np.float64)[order]
+        self.filenames = np.asarray(filenames, dtype=object)[order]
+        self.max_width = self.widths.max() if len(self.widths) else 0.0
+        # Filenames of recent queries, dropped together with the index. The
+        # server shares one index between its request threads
+        self._query_cache = {}
+        self._query_cache_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.xs)
+
+    def filenames_within(self, bounds):
+        """Finds the filenames of the tiles within the bounding box, reusing recent results
+
+        Args:
+            bounds (tuple): The bounding box (xmin, ymin, xmax, ymax)
+
+        Returns:
+            tuple[string]: The filenames inside the bounding box
+        """
+        with self._query_cache_lock:
+            filenames = self._query_cache.get(bounds)
+        if filenames is None:
+            # The tiles and the selected area are both axis-aligned boxes, so
+            # the interval test in find_tiles is already the exact
+            # intersection test
+            filenames = tuple(tile["filename"] for tile in find_tiles(self, bounds))
+            with self._query_cache_lock:
+                if len(self._query_cache) >= QUERY_CACHE_SIZE:
+                    self._query_cache.pop(next(iter(self._query_cache)))
+                self._query_cache[bounds] = filenames
+        return filenames
 
 
 def find_tiles(data, bounds):
     """Finds all the tiles that are withing the bounding box 
 
     Args:
-        data (directory):The atlas directory  
-        bounds (Shapely box): The bounding box
+        data (TileIndex):The atlas tiles  
+        bounds (tuple): The bounding box (xmin, ymin, xmax, ymax)
 
     Returns:
-        Tile: The tile with the geometry
+        list[dict]: The tiles of the index within the bounding box, each with
+        its "geometry" (shapely box) and "filename"
     """
-    
-    constant = 20000
-    x_data = list(data)
-    if not data:
-        return []  
-
-    index_x = binary_search_within_range(x_data, bounds[0]-constant, bounds[0])
-    if not index_x and bounds[0] < int(x_data[0]):
-        index_x = 0
-    # print(bounds[0], x_data[0])
-    if index_x == None:
+    if not len(data):
+        return []
+
+    xmin, ymin, xmax, ymax = bounds
+
+    # Tiles are sorted by x, so only the slice of tiles starting within one
+    # tile width of the bounding box needs to be checked
+    lo = np.searchsorted(data.xs, xmin - data.max_width, side='left')
+    hi = np.searchsorted(data.xs, xmax, side='right')
+    xs = data.xs[lo:hi]
+    ys = data.ys[lo:hi]
+    mask = ((xs + data.widths[lo:hi] >= xmin) &
+            (ys <= ymax) & (ys + data.heights[lo:hi] >= ymin))
+    indices = lo + np.flatnonzero(mask)
+    if len(indices) == 0:
         info("Server does not contain data requested")
         return []
-    x_min = x_data[index_x]
-    tiles = []
-    while int(x_min) <= bounds[2] + constant:
-        y_data = list(data[x_data[index_x]])
-        index_y = binary_search_within_range(y_data, bounds[1]-constant, bounds[1])
-        if not index_y and bounds[1] <= int(y_data[0]):
-            index_y = 0
-        if index_y == None:
-            info("Server does not contain data requested")
-            return []
-        y_min = y_data[index_y]
-        previous_max = 0
-        while int(y_min) <= bounds[3] + constant and previous_max < bounds[3] + constant:
-            info = data[x_min][y_min]
-            x = float(x_min)
-            y = float(y_min)
-            width = info["width"]
-            height = info["height"]
-            tile = {
-
-                    "geometry": Polygon([(x,y), (x,y+height), (x+width,y+height), (x+width,y)]),
-                    'filename': info['filename']
-            }
-            tiles.append(tile)
-            previous_max = data[x_min][y_min]["width"] + int(y_min)
-            
-            try:
-                index_y+=1
-                y_min = y_data[index_y]
-            except:
-                break
-        try:
-            index_x+=1
-            x_min = x_data[index_x]
-        except:
-            break
-    return tiles
-# print(tiles)
+
+    xs = data.xs[indices]
+    ys = data.ys[indices]
+    geometries = shapely.box(xs, ys, xs + data.widths[indices], ys + data.heights[indices])
+    return [{"geometry": geometry, "filename": filename}
+            for geometry, filename in zip(geometries, data.filenames[indices])]
 
 def find_files(data, selected_area):
     """Extracts the information gived by the tiles of the find_tiles and returns only the filenames
@@ -109,46 +115,15 @@ def find_files(data, selected_area):
     Returns:
         list[string]: The filenames inside the bounding box
     """
-    start = time.time()
-
     # Converting dtcc_model.Bounds object to shapely.Polygon for necassery checks.
-    shply_selected_area = Polygon(((selected_area.xmin,selected_area.ymin),
-                                   (selected_area.xmax,selected_area.ymin),
-                                   (selected_area.xmax,selected_area.ymax),
-                                   (selected_area.xmin,selected_area.ymax)))
-    
-    hardcoded_bounds = Polygon([(266646,5921055), (516646,5921055),(766646,6171055),(1016646,6921055), (516646,5421055), (516646,7671055), (266646,7421055), (266646,5921055)])
-    if hardcoded_bounds.covers(shply_selected_area):
+    shply_selected_area = box(*selected_area.tuple)
+    if HARDCODED_BOUNDS.covers(shply_selected_area):
         info("Finding files...")
-    elif hardcoded_bounds.intersects(shply_selected_area):
+    elif HARDCODED_BOUNDS.intersects(shply_selected_area):
         info("Some of the area you provided is out of bounds, Computing the area only inside bounds...")
     else:
         info("The area you provided is out of bounds...")
         return []
-    tiles = find_tiles(data, selected_area.tuple)
-
-
-    if not tiles:
-        # returns empty laz file list in case that something went wrong when preprocessing tiles
-        return []
-    gdf = gpd.GeoDataFrame(tiles)
-    spec1 = time.time()
-    merged_tiles = gdf.unary_union
-    spec2 = time.time()
-    merging_time = spec2-spec1
-    info(f"Merging tiles elapsed time: {merging_time:.8f} sec" ) 
-    missing_areas = shply_selected_area.difference(merged_tiles)
-
-    intersecting_tiles = gdf[gdf.intersects(shply_selected_area)]
-    files = intersecting_tiles['filename'].tolist()
-
-
-    # print(intersecting_tiles)
-    # print(len(laz_files))
-    # end = time.time()
-    # print(end-start)
-    return files
-
-    
-        
-       
\ No newline at end of file
+    if not isinstance(data, TileIndex):
+        data = TileIndex(data)
+    return list(data.filenames_within(selected_area.tuple))
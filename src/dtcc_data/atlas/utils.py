@@ -1,8 +1,48 @@
-from collections import OrderedDict
-import json
+import orjson
 import os
-import laspy
 import math
+import struct
+
+# Offsets of the bounds in the LAS public header block (identical for LAS
+# 1.0-1.4, and LAZ files keep the header uncompressed)
+LAS_HEADER_SIZE = 227
+LAS_BOUNDS_OFFSET = 179
+LAS_BOUNDS_FORMAT = "<dddd"  # max_x, min_x, max_y, min_y
+
+# WGS84 to SWEREF 99 TM. This is the pipeline PROJ resolves for
+# EPSG:4326 -> EPSG:3006 (lon/lat order), given directly to skip the lookup in
+# the PROJ database
+WGS84_TO_SWEREF99TM = (
+    "+proj=pipeline "
+    "+step +proj=unitconvert +xy_in=deg +xy_out=rad "
+    "+step +proj=utm +zone=33 +ellps=GRS80"
+)
+
+def read_atlas(filename):
+    """reads an atlas json file
+
+    Args:
+        filename (string): atlas filename
+
+    Returns:
+        dict: the atlas data
+    """
+    with open(filename, "rb") as file:
+        return orjson.loads(file.read())
+
+def write_atlas(data, filename, sort_keys=False):
+    """writes an atlas json file
+
+    Args:
+        data (dict): the atlas data, keys may be strings or numbers
+        filename (string): atlas filename
+        sort_keys (bool): sort the keys of all levels while serializing
+    """
+    option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    with open(filename, "wb") as file:
+        file.write(orjson.dumps(data, option=option))
 
 def get_tile_info(filename):
     """extracts laz file and finds necessary information 
@@ -13,29 +53,35 @@ def get_tile_info(filename):
     Returns:
         list[int]: mix max coordinates
     """
-    # Open the .laz file and extract min x and y
-    with laspy.open(filename) as file:
-        las = file.read()
-        min_x = int(float(f"{las.x.min():.2f}"))  # Format to 2 decimal places for consistency
-        min_y = int(float(f"{las.y.min():.2f}"))
-        max_x = int(float(f"{las.x.max():.2f}")) 
-        max_y = int(float(f"{las.y.max():.2f}"))
+    # Only the bounds are needed, so read them directly from the header
+    # instead of decoding the point records
+    with open(filename, "rb") as file:
+        header = file.read(LAS_HEADER_SIZE)
+    if len(header) < LAS_HEADER_SIZE or header[:4] != b"LASF":
+        raise ValueError(f"{filename} is not a LAS/LAZ file")
+    max_x, min_x, max_y, min_y = struct.unpack_from(LAS_BOUNDS_FORMAT, header, LAS_BOUNDS_OFFSET)
+    min_x = int(float(f"{min_x:.2f}"))  # Format to 2 decimal places for consistency
+    min_y = int(float(f"{min_y:.2f}"))
+    max_x = int(float(f"{max_x:.2f}")) 
+    max_y = int(float(f"{max_y:.2f}"))
     return min_x, min_y, max_x, max_y
 
-def update_laz_atlas(directory, atlas):
+def update_laz_atlas(directory, atlas, filenames=None):
     """updates the laz atlas 
 
     Args:
         directory (string): name of the directory of the downloaded files
         atlas (string): atlas filename
+        filenames (list[string]): the downloaded files, defaults to all files in the directory
     """
     try:
-        with open(atlas, 'r') as file:
-            data = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
+        data = read_atlas(atlas)
+    except (FileNotFoundError, orjson.JSONDecodeError):
         data = {}
 
-    for file in os.listdir(directory):
+    if filenames is None:
+        filenames = os.listdir(directory)
+    for file in filenames:
         if file.endswith(".laz"):
             full_path = os.path.join(directory, file)
             min_x, min_y, max_x, max_y = get_tile_info(full_path)
@@ -48,14 +94,8 @@ def update_laz_atlas(directory, atlas):
                 data[str(min_x)][str(min_y)] = {"height": max_y-min_y,
                                                     "width": max_x-min_x,
                                                     "filename": file}
-    sorted_catalog = OrderedDict()
-    for minx in sorted(data.keys()):
-        sorted_catalog[minx] = OrderedDict()
-        for miny in sorted(data[minx].keys()):
-            sorted_catalog[minx][miny] = data[minx][miny]
-                
-    with open(atlas, 'w') as json_file:
-        json.dump(sorted_catalog, json_file, indent=4)
+    # The keys are sorted by the encoder, so the new tiles are only inserted
+    write_atlas(data, atlas, sort_keys=True)
 
 
 def update_gpkg_atlas(directory, atlas):
@@ -67,11 +107,9 @@ def update_gpkg_atlas(directory, atlas):
     """
     missing_files_file = os.path.join(directory, "missing_coords.json")
 
-    with open(missing_files_file, "r") as mff:
-        missing_filenames = json.load(mff)
+    missing_filenames = read_atlas(missing_files_file)
     try:
-        with open(atlas, "r") as f:
-            data = json.load(f)
+        data = read_atlas(atlas)
     except:
         data = {}
     for item in missing_filenames:
@@ -85,10 +123,5 @@ def update_gpkg_atlas(directory, atlas):
             data[str(coords[0])][str(coords[1])] = {"height": 10000.0,
                                                     "width": 10000.0,
                                                     "filename": item}
-    sorted_catalog = OrderedDict()
-    for minx in sorted(data.keys()):
-        sorted_catalog[minx] = OrderedDict()
-        for miny in sorted(data[minx].keys()):
-            sorted_catalog[minx][miny] = data[minx][miny]
-    with open(atlas, "w") as f:
-        json.dump(sorted_catalog, f, indent=4)
\ No newline at end of file
+    # The keys are sorted by the encoder, so the new tiles are only inserted
+    write_atlas(data, atlas, sort_keys=True)
\ No newline at end of file
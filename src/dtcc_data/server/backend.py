@@ -1,43 +1,43 @@
 import threading
 import webbrowser
-from flask import Flask, render_template, request, jsonify, send_file
-import tarfile
+from flask import Flask, Response, render_template, request, jsonify
 import os
 import sys
-import json
+import orjson
 import time
-from pyproj import Proj, transform
+from pyproj import Transformer
 from dtcc_model import Bounds
 # import pyautogui
 
 base_url = "http://129.16.69.36:54321"
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from atlas import prototype
+from atlas.utils import WGS84_TO_SWEREF99TM
+from tar_stream import tar_stream
 
 findFiles = prototype.find_files
 
 app = Flask(__name__)
 start_time = time.time()
 laz_directory = "../../../../../65_3" #DATA LOCATION HERE
-zip_folder = "zipped_data"
 
 try:
-    with open("atlas_lidar.json", "r") as f1:
-        laz_data = json.load(f1)
+    with open("atlas_lidar.json", "rb") as f1:
+        laz_data = orjson.loads(f1.read())
 except:
     print("Missing Laz atlas. Trying to start without bygg atlas")  
     laz_data = None      
 
 try:
-    with open("atlas_bygg.json", "r") as f2:
-        bygg_data = json.load(f2)
+    with open("atlas_bygg.json", "rb") as f2:
+        bygg_data = orjson.loads(f2.read())
 except:
     print("Missing bygg atlas. Trying to start without bygg atlas.")
     bygg_data = None
 
 try:
-    with open("atlas_vl.json", "r") as f3:
-        vl_data = json.load(f3)
+    with open("atlas_vl.json", "rb") as f3:
+        vl_data = orjson.loads(f3.read())
 except:
     print("Missing bygg atlas. Trying to start without bygg atlas.")
     vl_data = None
@@ -46,38 +46,66 @@ if not laz_data and not bygg_data and not vl_data:
     print("All atlas files are missing. The server cannot serve data so its terminated")
     exit()
 
-if not os.path.exists(zip_folder):
-        os.mkdir(zip_folder)
+# Flatten the atlases into sorted arrays once instead of on every request
+TileIndex = prototype.TileIndex
+laz_data = TileIndex(laz_data) if laz_data else None
+bygg_data = TileIndex(bygg_data) if bygg_data else None
+vl_data = TileIndex(vl_data) if vl_data else None
 
-def create_tarball(output_filename, directory, file_list, extra_file = None):
+# Mapping from tile filename to the lower left corner of the tile, sent along
+# with downloaded GeoPackage tiles so the client can update its atlas
+file_to_coords = {}
+for filetype in ("bygg", "vl"):
+    try:
+        with open(f"file_to_coords_{filetype}.json", "rb") as ftc:
+            file_to_coords[filetype] = orjson.loads(ftc.read())
+    except:
+        print(f"Missing file_to_coords_{filetype}.json. {filetype} files can not be downloaded.")
+
+def available_files(directory, file_list):
+    """
+    Keep only the requested files that exist in the directory, logging the others.
+
+    Args:
+    directory (str): The directory containing the files.
+    file_list (list): The requested filenames.
+    """
+    existing_files = []
+    for filename in file_list:
+        file_path = os.path.join(directory, filename)
+        if not os.path.exists(file_path):
+            app.logger.warning("Requested file not found: %s", file_path)
+            continue
+        existing_files.append(filename)
+    return existing_files
+
+def stream_tarball(directory, file_list, extra_members = None):
     """
-    Create a tar.gz archive of specific files within a directory.
+    Stream an uncompressed tar archive of specific files within a directory.
+
+    The archived LAZ and GPKG files are already compressed, so the archive is
+    not gzipped and is sent while the files are read instead of being
+    written to disk first.
 
     Args:
-    output_filename (str): The path where the tar.gz file will be saved.
     directory (str): The directory containing the files to be archived.
-    file_list (list): A list of filenames to be included in the archive.
+    file_list (list): A list of existing filenames to be included in the archive.
+    extra_members (dict): Additional in-memory members, mapping name to bytes.
     """
-    with tarfile.open(output_filename, "w:gz") as tar:
-        for filename in file_list:
-            file_path = os.path.join(directory, filename)
-            if os.path.exists(file_path):
-                tar.add(file_path, arcname=filename)
-            else:
-                print(f"File not found: {file_path}")
-        if extra_file:        
-            tar.add(extra_file)
-    try:        
-        os.remove(extra_file)
-    except:
-        pass
+    content_length, chunks = tar_stream(directory, file_list, extra_members)
+    return Response(chunks, mimetype='application/x-tar', headers={
+        'Content-Disposition': 'attachment; filename=example.tar',
+        'Content-Length': str(content_length),
+    })
 
 # Store coordinates globally
 coordinates = None
+# Set when coordinates are submitted, waited on by /wait_coordinates
+coordinates_submitted = threading.Event()
+# Longest time a /wait_coordinates request may hold a worker thread (seconds)
+MAX_COORDINATES_WAIT = 10
 
-# Initialize projections for WGS84 and SWEREF 99 TM
-wgs84 = Proj(proj='latlong', datum='WGS84')
-sweref99tm = Proj(init='epsg:3006')
+wgs84_to_sweref99tm = Transformer.from_pipeline(WGS84_TO_SWEREF99TM)
 
 # HTML content for the map page
 
@@ -87,6 +115,7 @@ def open_map():
     # Reset coordinates
     global coordinates
     coordinates = None
+    coordinates_submitted.clear()
     
     # Open the map in a browser
     threading.Thread(target=open_browser).start()
@@ -98,6 +127,7 @@ def map_page():
     """Serve the map to the user."""
     global coordinates
     coordinates = None
+    coordinates_submitted.clear()
     return render_template('index.html')
 
 @app.route('/submit', methods=['POST'])
@@ -105,6 +135,7 @@ def submit_coordinates():
     global coordinates
     data = request.json
     coordinates = transform_coordinates(data['topLeft'], data['bottomRight'])
+    coordinates_submitted.set()
     print("Transformed coordinates:", coordinates)
     
     # Gracefully shut down the server and close the browser
@@ -120,13 +151,22 @@ def get_coordinates():
     else:
         return jsonify({'error': 'No coordinates have been submitted yet.'}), 400
 
+@app.route('/wait_coordinates', methods=['GET'])
+def wait_coordinates():
+    """API endpoint that waits up to timeout seconds for coordinates to be submitted."""
+    timeout = min(request.args.get('timeout', MAX_COORDINATES_WAIT, type=float), MAX_COORDINATES_WAIT)
+    coordinates_submitted.wait(timeout)
+    return get_coordinates()
+
 def transform_coordinates(top_left, bottom_right):
-    # Transform coordinates from WGS84 to SWEREF 99 TM
-    top_left_x, top_left_y = transform(wgs84, sweref99tm, top_left['lng'], top_left['lat'])
-    bottom_right_x, bottom_right_y = transform(wgs84, sweref99tm, bottom_right['lng'], bottom_right['lat'])
+    # Transform both corners from WGS84 to SWEREF 99 TM in a single call
+    xs, ys = wgs84_to_sweref99tm.transform(
+        [top_left['lng'], bottom_right['lng']],
+        [top_left['lat'], bottom_right['lat']]
+    )
     return {
-        'topLeft': {'x': top_left_x, 'y': top_left_y},
-        'bottomRight': {'x': bottom_right_x, 'y': bottom_right_y}
+        'topLeft': {'x': xs[0], 'y': ys[0]},
+        'bottomRight': {'x': xs[1], 'y': ys[1]}
     }
 
 def shutdown_server_and_close_browser():
@@ -168,57 +208,36 @@ def process_bounding_box():
     })
     
 
+def download_gpkg_files(filetype):
+    """Stream the requested GeoPackage tiles together with their coordinates."""
+    directory = f"tiled_data_{filetype}"
+    # Files that can not be sent are left out of missing_coords.json as well,
+    # so the client atlas only lists tiles it received
+    data_list = available_files(directory, request.get_json(())["filenames"])
+    coords = file_to_coords.get(filetype, {})
+    missing_files_coords = {file: coords[file] for file in data_list}
+    missing_coords = orjson.dumps(missing_files_coords, option=orjson.OPT_INDENT_2)
+    return stream_tarball(directory, data_list, {"missing_coords.json": missing_coords})
+
 @app.route('/download-bygg', methods=['POST', 'GET']) 
 def download_bygg_files():
-    try:
-        os.remove("zipped_data/myfiles.tar.gz")
-    except:
-        pass
-    with open("file_to_coords_bygg.json", "r") as ftc:
-        data = json.load(ftc)
-    data_list = request.get_json(())["filenames"]
-    missing_files_coords = {}
-    for file in data_list:
-        print(data[file])
-        missing_files_coords[file] = data[file]
-    with open("missing_coords.json", "w") as coords:
-        json.dump(missing_files_coords, coords, indent=4)
-    # with tarfile.open('zipped_data/myfiles.tar.gz', "w:gz") as tar:
-    #     tar.add("missing_coords.json")
-    create_tarball("zipped_data/myfiles.tar.gz", "tiled_data_bygg", data_list, "missing_coords.json")
-    return send_file('zipped_data/myfiles.tar.gz', as_attachment=True, download_name='example.tar')
-
+    return download_gpkg_files("bygg")
 
 @app.route('/download-vl', methods=['POST', 'GET']) 
 def download_vl_files():
-    try:
-        os.remove("zipped_data/myfiles.tar.gz")
-    except:
-        pass
-    with open("file_to_coords_vl.json", "r") as ftc:
-        data = json.load(ftc)
-    data_list = request.get_json(())["filenames"]
-    missing_files_coords = {}
-    for file in data_list:
-        print(data[file])
-        missing_files_coords[file] = data[file]
-    with open("missing_coords.json", "w") as coords:
-        json.dump(missing_files_coords, coords, indent=4)
-    # with tarfile.open('zipped_data/myfiles.tar.gz', "w:gz") as tar:
-    #     tar.add("missing_coords.json")
-    create_tarball("zipped_data/myfiles.tar.gz", "tiled_data_vl", data_list, "missing_coords.json")
-    return send_file('zipped_data/myfiles.tar.gz', as_attachment=True, download_name='example.tar')
-
-
+    return download_gpkg_files("vl")
 
 @app.route('/download-laz', methods=['GET'])
 def download_laz_files():
     data_list = request.get_json(())
-    if os.path.exists("zipped_data/myfiles.tar.gz"):
-        os.remove("zipped_data/myfiles.tar.gz")
-    # create_tarball("zipped_data/myfiles.tar.gz", "../../../atlas_small", data_list["filenames"]) #laz files
-    create_tarball("zipped_data/myfiles.tar.gz", laz_directory, data_list["filenames"])
-    return send_file('zipped_data/myfiles.tar.gz', as_attachment=True, download_name='example.tar')
+    return stream_tarball(laz_directory, available_files(laz_directory, data_list["filenames"]))
 
 if __name__ == '__main__':
-    app.run(host = "0.0.0.0" ,debug=True, port=54321)
+    # Serve with a multi-threaded WSGI server so tile queries and downloads
+    # from several clients are handled concurrently. Every client waiting for
+    # map coordinates holds a thread for up to MAX_COORDINATES_WAIT seconds,
+    # so the pool leaves room for 8 downloads and queries next to 24 waiting
+    # clients, and /submit is never queued behind the waiters for longer
+    # than that
+    from waitress import serve
+    serve(app, host="0.0.0.0", port=54321, threads=32)
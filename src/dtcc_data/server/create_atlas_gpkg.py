@@ -1,62 +1,178 @@
 import os
+import math
 import json
 import geopandas as gpd
-from shapely.geometry import box
+import pandas as pd
+import pyogrio
+import shapely
+from pyproj import Transformer
 import numpy as np
 from multiprocessing import Pool
 import time
 from collections import OrderedDict
 import sys
+from functools import lru_cache
+
+TILE_SIZE = 10000
+# Lower left corner of the tile grid shared by all sources in hardcoded_bounds.json
+GRID_ORIGIN_X = 266646
+GRID_ORIGIN_Y = 5921055
 
 def list_gpkg_files(directory):
     """ List all gpkg files in a specified directory. """
-    return [f for f in os.listdir(directory) if f.endswith('.gpkg')]
+    with os.scandir(directory) as entries:
+        return [e.name for e in entries if e.name.endswith('.gpkg') and e.is_file()]
 
 def read_json_coordinates(json_file):
     """ Read JSON file that contains coordinates for each tile. """
     with open(json_file, 'r') as file:
         return json.load(file)
     
+@lru_cache(maxsize=32)
+def get_transformer(crs_from, crs_to):
+    """ Return a cached transformer and the edge densification suited for it. """
+    transformer = Transformer.from_crs(crs_from, crs_to, always_xy=True)
+    # Projected to projected transforms are close to affine over a tile grid,
+    # only geographic coordinates need dense edge sampling
+    if transformer.source_crs.is_geographic or transformer.target_crs.is_geographic:
+        densify_pts = 21
+    else:
+        densify_pts = 4
+    return transformer, densify_pts
+
+def read_source_bounds(gpkg_path):
+    """ Read the bounds of a source file from its metadata without loading any features. """
+    info = pyogrio.read_info(gpkg_path, force_total_bounds=True)
+    minx, miny, maxx, maxy = info['total_bounds']
+    if info['crs'] is not None and info['crs'] != 'EPSG:3006':
+        transformer, densify_pts = get_transformer(info['crs'], 'EPSG:3006')
+        minx, miny, maxx, maxy = transformer.transform_bounds(minx, miny, maxx, maxy, densify_pts=densify_pts)
+
+    # Snap outwards to the shared tile grid so the tiles line up with the
+    # tiles (and atlas keys) of every other source, same layout as the
+    # entries of the hardcoded bounds file
+    minx = GRID_ORIGIN_X + math.floor((minx - GRID_ORIGIN_X) / TILE_SIZE) * TILE_SIZE
+    miny = GRID_ORIGIN_Y + math.floor((miny - GRID_ORIGIN_Y) / TILE_SIZE) * TILE_SIZE
+    maxx = GRID_ORIGIN_X + math.ceil((maxx - GRID_ORIGIN_X) / TILE_SIZE) * TILE_SIZE
+    maxy = GRID_ORIGIN_Y + math.ceil((maxy - GRID_ORIGIN_Y) / TILE_SIZE) * TILE_SIZE
+    return [minx, maxy, maxx, miny]
+
 def generate_tiles(gdf, tile_size, bounds):
     """ Generate grid tiles based on the given bounds and tile size. """
-    tiles = []
-    ids = []
 
     # Get the bounds of the geodataframe
     minx, maxy, maxx, miny = bounds
 
-    # Generate tiles
+    # Generate the lower left corners of all tiles at once and build the tile
+    # geometries with a single vectorized call
     x_coords = np.arange(minx, maxx, tile_size)
     y_coords = np.arange(miny, maxy, tile_size)
-    for i, x in enumerate(x_coords):
-        for j, y in enumerate(y_coords):
-            tiles.append(box(x, y, x + tile_size, y + tile_size))
-            ids.append(f"tile_{x}_{y}")
+    xs, ys = np.meshgrid(x_coords, y_coords, indexing='ij')
+    xs = xs.ravel()
+    ys = ys.ravel()
+    tiles = shapely.box(xs, ys, xs + tile_size, ys + tile_size)
+    ids = [f"tile_{x}_{y}" for x, y in zip(xs.tolist(), ys.tolist())]
 
     # Create a GeoDataFrame with the tiles and their IDs
     tiles_gdf = gpd.GeoDataFrame({'geometry': tiles, 'tile_id': ids}, crs=gdf.crs)
     
     return tiles_gdf
 
-def process_tile(tile_info):
-    tile_geom, tile_id, gdf, output_directory = tile_info
-    minx, miny, maxx, maxy = tile_geom.bounds
-    height = maxy - miny
-    width = maxx - minx
-    minx = int(minx)
-    miny = int(miny)
-
-    intersecting_polygons = gpd.overlay(gdf, gpd.GeoDataFrame({'geometry': [tile_geom]}, crs=gdf.crs), how='intersection')
-
-    if not intersecting_polygons.empty:
+def check_disjoint_sources(sources):
+    """ Raise if two sources cover the same grid cell, as their tile files would collide. """
+    owners = {}
+    for gpkg_path, bounds, _ in sources:
+        minx, maxy, maxx, miny = bounds
+        for x in np.arange(minx, maxx, TILE_SIZE).tolist():
+            for y in np.arange(miny, maxy, TILE_SIZE).tolist():
+                owner = owners.setdefault((x, y), gpkg_path)
+                if owner != gpkg_path:
+                    raise ValueError(f"{os.path.basename(owner)} and {os.path.basename(gpkg_path)} "
+                                     f"both cover the tile at ({x}, {y})")
+
+def init_worker():
+    """ Configure GDAL once per worker process instead of once per source. """
+    pyogrio.set_gdal_config_options({
+        # SQLite page cache (MB) shared by the bbox read and the tile writes
+        'OGR_SQLITE_CACHE': 512,
+        # GDAL raster/block cache (MB)
+        'GDAL_CACHEMAX': 512,
+    })
+
+def process_source(source_info):
+    """ Tile a single source file and return the catalog entries of its tiles. """
+    gpkg_path, bounds, output_directory = source_info
+    gpkg_name = os.path.basename(gpkg_path)
+    print(f"Processing {gpkg_name}...")
+    minx, maxy, maxx, miny = bounds
+    start_read = time.time()
+    # The tile grid is in SWEREF 99 TM, so sources in other projections are
+    # filtered with the grid bounds in their own CRS and reprojected once
+    read_bbox = (minx, miny, maxx, maxy)
+    crs = pyogrio.read_info(gpkg_path)['crs']
+    reproject = crs is not None and crs != 'EPSG:3006'
+    if reproject:
+        transformer, densify_pts = get_transformer('EPSG:3006', crs)
+        read_bbox = transformer.transform_bounds(*read_bbox, densify_pts=densify_pts)
+    # The bbox filter is resolved by OGR through the GeoPackage rtree, so
+    # only features overlapping the tiled area are read
+    gdf = pyogrio.read_dataframe(gpkg_path, bbox=read_bbox, use_arrow=True)
+    if reproject:
+        gdf = gdf.to_crs(epsg=3006)
+    end_read = time.time()
+    print("Time for reading", end_read-start_read, gpkg_name)
+    start = time.time()
+    tiles_gdf = generate_tiles(gdf, TILE_SIZE, bounds)
+    tile_geoms = tiles_gdf.set_index('tile_id').geometry
+
+    # Bucket polygons whose bounding box lies inside a single grid cell (the
+    # vast majority for buildings) with integer arithmetic; these need no
+    # clipping, so only polygons straddling cell borders go through GEOS
+    ny = len(np.arange(miny, maxy, TILE_SIZE))
+    nx = len(tiles_gdf) // ny if ny else 0
+    feature_bounds = gdf.bounds.to_numpy()
+    ix = (feature_bounds[:, [0, 2]] - minx) // TILE_SIZE
+    iy = (feature_bounds[:, [1, 3]] - miny) // TILE_SIZE
+    interior = ((ix[:, 0] == ix[:, 1]) & (iy[:, 0] == iy[:, 1]) &
+                (ix[:, 0] >= 0) & (ix[:, 0] < nx) & (iy[:, 0] >= 0) & (iy[:, 0] < ny))
+    cells = (ix[interior, 0] * ny + iy[interior, 0]).astype(np.int64)
+    inside = gdf[interior].assign(tile_id=tiles_gdf['tile_id'].to_numpy()[cells])
+    straddling = gdf[~interior]
+
+    # Discard grid cells without any straddling polygons (sea, uninhabited
+    # areas) before the overlay, using a single bulk query against the
+    # spatial index
+    tile_idx, _ = straddling.sindex.query(tiles_gdf.geometry, predicate='intersects')
+    tiles_gdf = tiles_gdf.iloc[np.unique(tile_idx)]
+
+    # Clip the straddling polygons against the remaining tile grid in a single
+    # overlay (which uses the spatial index internally) and dispatch all
+    # pieces to their tiles
+    clipped = gpd.overlay(straddling, tiles_gdf, how='intersection')
+    pieces = pd.concat([inside, clipped], ignore_index=True)
+    if pieces.empty:
+        print("No polygons inside the tiled area of", gpkg_name)
+        return []
+
+    entries = []
+    for tile_id, intersecting_polygons in pieces.groupby('tile_id'):
+        tile_geom = tile_geoms[tile_id]
+        minx, miny, maxx, maxy = tile_geom.bounds
+        height = maxy - miny
+        width = maxx - minx
+        minx = int(minx)
+        miny = int(miny)
+
+        # Save the intersecting polygons to a separate file
         filename = f'{tile_id}.gpkg'
         output_file = os.path.join(output_directory, filename)
-        intersecting_polygons.to_file(output_file, driver='GPKG')
-
-        return minx, miny, height, width, filename
-    return None
+        pyogrio.write_dataframe(intersecting_polygons.drop(columns='tile_id'), output_file, driver='GPKG', use_arrow=True)
+        entries.append((minx, miny, height, width, filename))
+    end = time.time()
+    print("Time for processing", end-start, gpkg_name)
+    return entries
 
-def create_atlas(data_directory, output_directory, filetype):
+def create_atlas(data_directory, output_directory, filetype, processes=None):
 
     json_coords_file = 'hardcoded_bounds.json'
     if not os.path.exists(output_directory):
@@ -72,38 +188,23 @@ def create_atlas(data_directory, output_directory, filetype):
     if not gpkg_files:
         print("No files found to tile")
         return
-    
+
+    # Sources are independent, so tile them in parallel worker processes
+    sources = []
     for gpkg_name in gpkg_files:
-        print(f"Processing {gpkg_name}...")
         gpkg_path = os.path.join(data_directory, gpkg_name)
-        start_read = time.time()
-        gdf = gpd.read_file(gpkg_path)
-        end_read = time.time()
-        print("Time for reading", end_read-start_read, gpkg_name)
-        start = time.time()
-        bounds = coords[gpkg_name]
-        tiles_gdf = generate_tiles(gdf, 10000, bounds)
-
-        # Prepare tile information for parallel processing
-        for idx, tile in tiles_gdf.iterrows():
-            tile_id = tile['tile_id']
-            tile_geom = tile['geometry']
-            minx, miny, maxx, maxy = tile_geom.bounds
-            height = maxy - miny
-            width = maxx - minx
-            minx = int(minx)
-            miny = int(miny)
-
-            # Select polygons that intersect with the current tile
-            intersecting_polygons = gpd.overlay(gdf, gpd.GeoDataFrame({'geometry': [tile_geom]}, crs=gdf.crs), how='intersection')
-
-            if not intersecting_polygons.empty:
-                # Save the intersecting polygons to a separate file
-                filename = f'{tile_id}.gpkg'
-                output_file = os.path.join(output_directory, filename)
-                intersecting_polygons.to_file(output_file, driver='GPKG')
-
-                # Add tile information to the catalog
+        if gpkg_name in coords:
+            bounds = coords[gpkg_name]
+        else:
+            bounds = read_source_bounds(gpkg_path)
+        sources.append((gpkg_path, bounds, output_directory))
+    # Workers name tiles by their grid cell only, so overlapping sources would
+    # overwrite each other's tiles in whichever order they finish
+    check_disjoint_sources(sources)
+    with Pool(processes, initializer=init_worker) as pool:
+        for entries in pool.imap_unordered(process_source, sources):
+            # Add tile information to the catalog
+            for minx, miny, height, width, filename in entries:
                 if minx not in catalog:
                     catalog[minx] = {}
                 catalog[minx][miny] = {
@@ -112,8 +213,6 @@ def create_atlas(data_directory, output_directory, filetype):
                     'filename': filename
                 }
                 file_to_coords[filename] = [minx, miny]
-        end = time.time()
-        print("Time for processing", end-start, gpkg_name)
     start = time.time()
     sorted_catalog = OrderedDict()
     for minx in sorted(catalog.keys()):
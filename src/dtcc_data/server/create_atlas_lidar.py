@@ -1,12 +1,10 @@
-import math
 import os
-import json
-from collections import OrderedDict
 from tqdm import tqdm
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from atlas.utils import get_tile_info
+from atlas.utils import get_tile_info, write_atlas
 
 
 laz_folder = "../../../laz_data" # DATA LOCATION HERE
@@ -14,20 +12,23 @@ laz_folder = "../../../laz_data" # DATA LOCATION HERE
 def main(directory_path):
     files_structure = {}
     files = [f for f in os.listdir(directory_path) if f.endswith('.laz')]
-    atlas = []
-    for filename in tqdm(files, desc="Processing files"):
-        full_path = os.path.join(directory_path, filename)
-        min_x, min_y, max_x, max_y = get_tile_info(full_path)
-        
+    full_paths = [os.path.join(directory_path, f) for f in files]
+
+    # Reading the headers is dominated by file open latency, so the files
+    # are processed concurrently in a thread pool
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        tile_infos = list(tqdm(executor.map(get_tile_info, full_paths), total=len(files), desc="Processing files"))
+
+    # Insert the tiles ordered by (min_x, min_y) so the atlas is written with
+    # numerically sorted keys without building a sorted copy of it
+    tiles = sorted(zip(tile_infos, files))
+    for (min_x, min_y, max_x, max_y), filename in tiles:
         if min_x not in files_structure:
             files_structure[min_x] = {}
         
         files_structure[min_x][min_y] = {"filename" : filename, "width" : (max_x-min_x) + 1, "height" : (max_y-min_y) + 1}
-    
-    files_structure_sorted = {x: {y: files_structure[x][y] for y in sorted(files_structure[x])} for x in sorted(files_structure)}
 
-    with open('atlas_lidar.json', 'w') as json_file:
-        json.dump(files_structure_sorted, json_file, indent=4)
+    write_atlas(files_structure, 'atlas_lidar.json')
     
       
             
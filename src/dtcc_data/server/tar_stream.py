@@ -0,0 +1,64 @@
+import os
+import tarfile
+import time
+
+TAR_CHUNK_SIZE = 1024 * 1024
+
+def _tar_header(arcname, size, mtime):
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = size
+    tarinfo.mtime = mtime
+    tarinfo.mode = 0o644
+    return tarinfo.tobuf(tarfile.GNU_FORMAT, tarfile.ENCODING, "surrogateescape")
+
+def tar_stream(directory, file_list, extra_members = None):
+    """
+    Build an uncompressed tar archive of files within a directory as a stream of chunks.
+
+    The headers are built up front so the exact length of the archive is
+    known before any file is read. A file whose size changes before it is
+    sent raises an OSError instead of producing an archive that does not
+    match the announced length.
+
+    Args:
+    directory (str): The directory containing the files to be archived.
+    file_list (list): A list of filenames to be included in the archive.
+    extra_members (dict): Additional in-memory members, mapping name to bytes.
+
+    Returns:
+    tuple: The length of the archive in bytes and a generator of its chunks.
+    """
+    # Each entry holds either a file path or the in-memory content
+    entries = []
+    for filename in file_list:
+        file_path = os.path.join(directory, filename)
+        stat = os.stat(file_path)
+        entries.append((_tar_header(filename, stat.st_size, stat.st_mtime), file_path, None, stat.st_size))
+    for arcname, content in (extra_members or {}).items():
+        entries.append((_tar_header(arcname, len(content), time.time()), None, content, len(content)))
+
+    content_length = 2 * tarfile.BLOCKSIZE
+    for header, _, _, size in entries:
+        content_length += len(header) + size + (-size % tarfile.BLOCKSIZE)
+
+    def generate():
+        for header, file_path, content, size in entries:
+            yield header
+            if content is not None:
+                yield content
+            else:
+                with open(file_path, "rb") as f:
+                    remaining = size
+                    while remaining > 0:
+                        chunk = f.read(min(TAR_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise OSError(f"{file_path} shrank while it was being sent")
+                        remaining -= len(chunk)
+                        yield chunk
+                    if f.read(1):
+                        raise OSError(f"{file_path} grew while it was being sent")
+            yield tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+        # End of archive marker
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+    return content_length, generate()
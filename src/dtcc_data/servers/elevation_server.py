@@ -4,6 +4,7 @@ import psycopg
 import pyproj
 from pathlib import Path
 from affine import Affine
+from dtcc_data.atlas.utils import WGS84_TO_SWEREF99TM
 from time import time
 import sys
 
@@ -12,7 +13,7 @@ import signal
 app = Flask(__name__)
 hdf5_dir = Path("/Volumes/LaCie/projects/DTCC/LM Laserdata/Västra Götaland/HDF5_data")
 
-latlon2sweref = pyproj.Transformer.from_crs("epsg:4326", "epsg:3006", always_xy=True).transform
+latlon2sweref = pyproj.Transformer.from_pipeline(WGS84_TO_SWEREF99TM).transform
 
 
 def db_connect(
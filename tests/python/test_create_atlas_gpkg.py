@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+import geopandas as gpd
+import pyogrio
+from shapely.geometry import box
+
+from dtcc_data.server.create_atlas_gpkg import TILE_SIZE, check_disjoint_sources, process_source
+
+X0, Y0 = 266646, 5921055
+
+
+def cell(i, j):
+    return X0 + i * TILE_SIZE, Y0 + j * TILE_SIZE
+
+
+class TestProcessSource(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_directory = os.path.join(self.tmp.name, "tiles")
+        os.mkdir(self.output_directory)
+
+        # 2 x 2 grid: one polygon inside cell (0, 0), one inside cell (1, 1),
+        # one straddling the border between cells (0, 0) and (1, 0) and
+        # nothing in cell (0, 1)
+        x, y = cell(0, 0)
+        inside_00 = box(x + 100, y + 100, x + 200, y + 200)
+        x, y = cell(1, 1)
+        inside_11 = box(x + 5000, y + 5000, x + 5100, y + 5100)
+        x, y = cell(1, 0)
+        straddling = box(x - 300, y + 1000, x + 700, y + 1100)
+        self.source = gpd.GeoDataFrame(
+            {"name": ["inside_00", "inside_11", "straddling"]},
+            geometry=[inside_00, inside_11, straddling], crs="EPSG:3006")
+        self.gpkg_path = os.path.join(self.tmp.name, "source.gpkg")
+        pyogrio.write_dataframe(self.source, self.gpkg_path, driver="GPKG")
+
+        minx, miny = cell(0, 0)
+        maxx, maxy = cell(2, 2)
+        self.bounds = [minx, maxy, maxx, miny]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_tile(self, i, j):
+        x, y = cell(i, j)
+        return pyogrio.read_dataframe(os.path.join(self.output_directory, f"tile_{x}_{y}.gpkg"))
+
+    def test_process_source(self):
+        entries = process_source((self.gpkg_path, self.bounds, self.output_directory))
+
+        # Only cells containing polygons produce tiles
+        expected = {cell(0, 0), cell(1, 0), cell(1, 1)}
+        self.assertEqual({(minx, miny) for minx, miny, _, _, _ in entries}, expected)
+        for minx, miny, height, width, filename in entries:
+            self.assertEqual((height, width), (TILE_SIZE, TILE_SIZE))
+            self.assertEqual(filename, f"tile_{minx}_{miny}.gpkg")
+        x, y = cell(0, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.output_directory, f"tile_{x}_{y}.gpkg")))
+        self.assertEqual(len(os.listdir(self.output_directory)), 3)
+
+        # Polygons inside a single cell go unchanged to that cell's tile
+        tile_00 = self.read_tile(0, 0)
+        tile_11 = self.read_tile(1, 1)
+        self.assertNotIn("tile_id", tile_00.columns)
+        self.assertEqual(sorted(tile_00["name"]), ["inside_00", "straddling"])
+        self.assertEqual(list(tile_11["name"]), ["inside_11"])
+        inside_00 = tile_00[tile_00["name"] == "inside_00"].geometry.iloc[0]
+        self.assertTrue(inside_00.equals(self.source.geometry.iloc[0]))
+
+        # The straddling polygon is split at the cell border
+        tile_10 = self.read_tile(1, 0)
+        self.assertEqual(list(tile_10["name"]), ["straddling"])
+        left = tile_00[tile_00["name"] == "straddling"].geometry.iloc[0]
+        right = tile_10.geometry.iloc[0]
+        border = cell(1, 0)[0]
+        self.assertEqual(left.bounds[2], border)
+        self.assertEqual(right.bounds[0], border)
+        self.assertAlmostEqual(left.area, 300 * 100)
+        self.assertAlmostEqual(right.area, 700 * 100)
+
+
+class TestCheckDisjointSources(unittest.TestCase):
+
+    def bounds(self, i0, j0, i1, j1):
+        minx, miny = cell(i0, j0)
+        maxx, maxy = cell(i1, j1)
+        return [minx, maxy, maxx, miny]
+
+    def test_disjoint(self):
+        check_disjoint_sources([
+            ("a.gpkg", self.bounds(0, 0, 2, 2), "tiles"),
+            ("b.gpkg", self.bounds(2, 0, 4, 2), "tiles"),
+            ("c.gpkg", self.bounds(0, 2, 4, 3), "tiles"),
+        ])
+
+    def test_overlapping(self):
+        with self.assertRaisesRegex(ValueError, "a.gpkg and c.gpkg"):
+            check_disjoint_sources([
+                ("a.gpkg", self.bounds(0, 0, 2, 2), "tiles"),
+                ("b.gpkg", self.bounds(2, 0, 4, 2), "tiles"),
+                ("c.gpkg", self.bounds(1, 1, 3, 3), "tiles"),
+            ])
+
+
+if __name__ == '__main__':
+    unittest.main()
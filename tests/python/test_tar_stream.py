@@ -0,0 +1,55 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from dtcc_data.server.tar_stream import tar_stream
+
+
+class TestTarStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        self.contents = {
+            "tile_a.laz": os.urandom(70000),
+            "tile_b.gpkg": b"x" * 512,
+            "empty.gpkg": b"",
+        }
+        for filename, content in self.contents.items():
+            with open(os.path.join(self.directory, filename), "wb") as f:
+                f.write(content)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        extra = {"missing_coords.json": b'{"tile_b.gpkg": [0, 0]}'}
+        content_length, chunks = tar_stream(self.directory, list(self.contents), extra)
+        data = b"".join(chunks)
+        self.assertEqual(len(data), content_length)
+
+        expected = dict(self.contents, **extra)
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r|") as tar:
+            received = {member.name: tar.extractfile(member).read() for member in tar}
+        self.assertEqual(received, expected)
+
+    def test_empty_archive(self):
+        content_length, chunks = tar_stream(self.directory, [])
+        data = b"".join(chunks)
+        self.assertEqual(len(data), content_length)
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r|") as tar:
+            self.assertEqual(tar.getnames(), [])
+
+    def test_file_changed_after_stat(self):
+        for new_content in (b"short", os.urandom(80000)):
+            _, chunks = tar_stream(self.directory, ["tile_a.laz"])
+            with open(os.path.join(self.directory, "tile_a.laz"), "wb") as f:
+                f.write(new_content)
+            with self.assertRaises(OSError):
+                b"".join(chunks)
+
+
+if __name__ == '__main__':
+    unittest.main()
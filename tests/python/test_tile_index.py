@@ -0,0 +1,99 @@
+import random
+import threading
+import unittest
+
+import shapely
+
+from dtcc_data.atlas.prototype import QUERY_CACHE_SIZE, TileIndex, find_tiles
+
+
+def make_atlas():
+    """Small atlas with a regular grid and a few larger tiles, keyed like the atlas json"""
+    atlas = {}
+    for x in range(0, 100, 10):
+        for y in range(0, 100, 10):
+            atlas.setdefault(str(x), {})[str(y)] = {
+                "width": 10.0, "height": 10.0, "filename": f"tile_{x}_{y}.laz"}
+    for x, y, size in ((200, 0, 25), (230, 40, 50), (300, 300, 10000)):
+        atlas.setdefault(str(x), {})[str(y)] = {
+            "width": float(size), "height": float(size), "filename": f"big_{x}_{y}.gpkg"}
+    return atlas
+
+
+def brute_force(atlas, bounds):
+    query = shapely.box(*bounds)
+    found = set()
+    for x, column in atlas.items():
+        for y, tile in column.items():
+            x, y = float(x), float(y)
+            if shapely.box(x, y, x + tile["width"], y + tile["height"]).intersects(query):
+                found.add(tile["filename"])
+    return found
+
+
+class TestTileIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.atlas = make_atlas()
+        self.index = TileIndex(self.atlas)
+
+    def check(self, bounds):
+        tiles = find_tiles(self.index, bounds)
+        self.assertEqual({tile["filename"] for tile in tiles}, brute_force(self.atlas, bounds), bounds)
+        for tile in tiles:
+            self.assertTrue(tile["geometry"].intersects(shapely.box(*bounds)))
+
+    def test_sorted(self):
+        self.assertEqual(len(self.index), sum(len(column) for column in self.atlas.values()))
+        order = list(zip(self.index.xs, self.index.ys))
+        self.assertEqual(order, sorted(order))
+
+    def test_query_edges(self):
+        # Query edges on tile edges, touching tiles count as intersecting
+        for bounds in [
+            (10, 10, 20, 20),
+            (20, 20, 20, 20),
+            (0, 0, 0, 0),
+            (100, 100, 150, 150),
+            (95, 0, 100, 5),
+            (-10, -10, 0, 0),
+            (225, 25, 230, 40),
+            (10300, 10300, 10400, 10400),
+            (10300.5, 10300, 10400, 10400),
+        ]:
+            self.check(bounds)
+
+    def test_random_queries(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            x0, x1 = sorted(rng.choice([rng.uniform(-20, 400), rng.randrange(-20, 400, 5)]) for _ in range(2))
+            y0, y1 = sorted(rng.choice([rng.uniform(-20, 400), rng.randrange(-20, 400, 5)]) for _ in range(2))
+            self.check((x0, y0, x1, y1))
+
+    def test_empty(self):
+        self.assertEqual(find_tiles(TileIndex({}), (0, 0, 10, 10)), [])
+        self.assertEqual(find_tiles(self.index, (5000, -500, 6000, -400)), [])
+
+    def test_cache_shared_between_threads(self):
+        # Enough distinct queries from several threads to keep evicting
+        errors = []
+
+        def query(offset):
+            try:
+                for i in range(2 * QUERY_CACHE_SIZE):
+                    bounds = (offset + i / 10, 0, offset + i / 10 + 15, 15)
+                    self.assertEqual(set(self.index.filenames_within(bounds)), brute_force(self.atlas, bounds))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=query, args=(offset,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(self.index._query_cache), QUERY_CACHE_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()